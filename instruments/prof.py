@@ -1,16 +1,35 @@
 #!/usr/bin/env python3
 import argparse, os, glob, struct, mmap, collections, csv, subprocess, sys, math
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+try:
+    from numba import njit
+except ImportError:  # optional: stack replay falls back to pure Python
+    njit = None
 
 HEADER_FMT = "<8sIIQII"   # magic(8), pid(u32), tid(u32), start_ns(u64), rec_size(u32), flags(u32)
 RECORD_FMT = "<QQB7x"     # ts(u64), fn(u64), type(u8), pad(7)
-HEADER_SZ  = struct.calcsize(HEADER_FMT)
-RECORD_SZ  = struct.calcsize(RECORD_FMT)
+_HDR       = struct.Struct(HEADER_FMT)  # compiled once; bound methods reused per call
+_REC       = struct.Struct(RECORD_FMT)
+HEADER_SZ  = _HDR.size
+RECORD_SZ  = _REC.size
+REC_DTYPE  = np.dtype([("ts", "<u8"), ("fn", "<u8"), ("typ", "u1"), ("pad", "V7")])  # same layout as RECORD_FMT
+assert REC_DTYPE.itemsize == RECORD_SZ
 
-Agg = collections.namedtuple("Agg", "calls incl_ns excl_ns max_incl_ns")
-def agg_add(a, calls=0, incl=0, excl=0, mx=0):
-    if a is None: a = Agg(0,0,0,0)
-    return Agg(a.calls+calls, a.incl_ns+incl, a.excl_ns+excl, max(a.max_incl_ns, mx))
+def _zero_agg():
+    return [0, 0, 0, 0]
+
+def new_aggs():
+    # addr -> [calls, incl_ns, excl_ns, max_incl_ns]; missing keys start at zero so an
+    # update is one lookup. Module-level factory (not a lambda) so it pickles to workers
+    return collections.defaultdict(_zero_agg)
+
+def agg_add(aggs, key, calls=0, incl=0, excl=0, mx=0):
+    # aggs (from new_aggs) holds mutable lists, updated in place
+    a = aggs[key]
+    a[0] += calls; a[1] += incl; a[2] += excl
+    if mx > a[3]: a[3] = mx
 
 def parse_maps(maps_path):
     # Return list of mappings: (start, end, offset, pathname, executable_flag, base_vma)
@@ -33,91 +52,256 @@ def parse_maps(maps_path):
     maps.sort(key=lambda m: m[0])
     return maps
 
-def find_module(maps, addr):
-    # find mapping that contains addr
-    lo, hi = 0, len(maps)-1
-    while lo <= hi:
-        mid = (lo+hi)//2
-        s,e,off,path,execflag,base = maps[mid]
-        if addr < s: hi = mid - 1
-        elif addr >= e: lo = mid + 1
-        else: return maps[mid]
-    return None
+def find_modules(maps, addrs):
+    # Vectorized lookup: (idx into maps or -1, addr - base_vma) for a uint64 address array
+    if not maps:
+        return np.full(len(addrs), -1, np.int64), np.zeros(len(addrs), np.uint64)
+    starts = np.array([m[0] for m in maps], np.uint64)
+    ends = np.array([m[1] for m in maps], np.uint64)
+    bases = np.array([m[5] for m in maps], np.uint64)
+    idx = np.searchsorted(starts, addrs, side="right") - 1
+    safe = idx.clip(0)
+    hit = (idx >= 0) & (addrs < ends[safe])
+    return np.where(hit, idx, -1), addrs - bases[safe]
 
 def symbolize_batch(module, vmas):
-    # Call addr2line once with many VMAs; returns dict vma->(func, fileline) (func demangled)
+    # One addr2line per module with all VMAs on stdin (DWARF parsed once); returns dict vma->(func, fileline) (func demangled)
     # If addr2line is not available or fails, return {vma: (None, None), ...}
     try:
-        # chunk to avoid super-long command lines
-        out = {}
-        CHUNK = 2048
-        for i in range(0, len(vmas), CHUNK):
-            chunk = vmas[i:i+CHUNK]
-            args = ["addr2line", "-f", "-C", "-e", module] + [hex(v) for v in chunk]
-            cp = subprocess.run(args, capture_output=True, text=True)
-            if cp.returncode != 0:
-                for v in chunk: out[v] = (None, None)
-                continue
-            lines = cp.stdout.splitlines()
-            # addr2line prints pairs: function, file:line
-            for j,v in enumerate(chunk):
-                fn = lines[2*j] if 2*j < len(lines) else "??"
-                fl = lines[2*j+1] if 2*j+1 < len(lines) else "??:0"
-                out[v] = (fn if fn != "??" else None, fl if fl != "??:0" else None)
-        return out
+        cp = subprocess.run(["addr2line", "-f", "-C", "-e", module], input="".join(f"{v:#x}\n" for v in vmas),
+                            capture_output=True, text=True)
     except FileNotFoundError:
         return {v: (None, None) for v in vmas}
+    if cp.returncode != 0:
+        return {v: (None, None) for v in vmas}
+    out = {}
+    lines = cp.stdout.splitlines()
+    # addr2line prints pairs: function, file:line
+    for j,v in enumerate(vmas):
+        fn = lines[2*j] if 2*j < len(lines) else "??"
+        fl = lines[2*j+1] if 2*j+1 < len(lines) else "??:0"
+        out[v] = (fn if fn != "??" else None, fl if fl != "??:0" else None)
+    return out
 
-def load_header(f):
-    hdr = f.read(HEADER_SZ)
-    if len(hdr) != HEADER_SZ:
+def load_header(mm):
+    if len(mm) < HEADER_SZ:
         raise RuntimeError("bad header length")
-    magic,pid,tid,start_ns,rec_size,flags = struct.unpack(HEADER_FMT, hdr)
+    magic,pid,tid,start_ns,rec_size,flags = _HDR.unpack_from(mm, 0)
     if magic[:7] != b"FPROFv1":
         raise RuntimeError("bad magic")
     if rec_size != RECORD_SZ:
         raise RuntimeError(f"record size mismatch: file={rec_size}, expected={RECORD_SZ}")
     return pid, tid, start_ns, flags
 
-def analyze_thread_file(path, global_aggs):
-    stack = []  # list of frames: [ (fn, start_ns, child_ns) ]
-    last_ts = None
-    with open(path, "rb") as f:
-        pid, tid, start_ns, flags = load_header(f)
-        data = f.read()
-        nrec = len(data) // RECORD_SZ
-        view = memoryview(data)
-        off = 0
-        for _ in range(nrec):
-            ts_ns, fn, typ = struct.unpack_from(RECORD_FMT, view, off)
-            off += RECORD_SZ
-            last_ts = ts_ns
-            if typ == 0:  # enter
-                stack.append([fn, ts_ns, 0])
-            else:         # exit
-                # Drain until we find a matching frame to handle exceptions/unwinds
-                while stack:
-                    top_fn, start, child = stack.pop()
-                    incl = ts_ns - start if ts_ns >= start else 0
-                    excl = incl - child if incl >= child else 0
-                    # aggregate for top_fn
-                    global_aggs[top_fn] = agg_add(global_aggs.get(top_fn), calls=1, incl=incl, excl=excl, mx=incl)
-                    # attribute inclusive time to parent as child time
-                    if stack:
-                        stack[-1][2] += incl
-                    if top_fn == fn:
-                        break
-                # if stack empty and no match found, nothing else to do
-        # If frames remain (abrupt exit), close them at last_ts to keep totals conservative
-        if last_ts is not None and stack:
-            end_ts = last_ts
+def _advise_sequential(f, mm):
+    # Readahead hints for a front-to-back scan; MADV_* are separate advice values, not flags
+    try:
+        if hasattr(os, "posix_fadvise"): os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        if hasattr(mmap, "MADV_SEQUENTIAL"): mm.madvise(mmap.MADV_SEQUENTIAL)
+        if hasattr(mmap, "MADV_WILLNEED"): mm.madvise(mmap.MADV_WILLNEED)
+    except OSError:
+        pass  # hints only
+
+def _replay_kernel(ts, sid, is_enter, n_enter, open_sid, open_start, open_child, close_open, calls, incl, excl, max_incl, first):
+    # Numba-friendly stack replay on dense slot ids; totals go into the per-slot columns,
+    # first[s] ranks slots by their first exit (the order the stack replay creates dict keys).
+    # Starts from the carried open_* frames; returns the frames left open unless close_open
+    n = ts.shape[0]
+    cap = open_sid.shape[0] + n_enter + 1
+    stack_sid = np.empty(cap, np.int64); stack_start = np.empty(cap, np.int64); stack_child = np.empty(cap, np.int64)
+    sp = open_sid.shape[0]; seen = 0
+    stack_sid[:sp] = open_sid; stack_start[:sp] = open_start; stack_child[:sp] = open_child
+    for i in range(n):
+        t = ts[i]
+        e = is_enter[i]
+        # frame is always stored; sp only advances on an enter (no branch on that path)
+        stack_sid[sp] = sid[i]; stack_start[sp] = t; stack_child[sp] = 0
+        sp += e
+        if e == 0:       # exit: drain until match (exceptions/unwinds)
+            while sp > 0:
+                sp -= 1
+                s = stack_sid[sp]
+                d_incl = t - stack_start[sp] if t >= stack_start[sp] else 0
+                d_excl = d_incl - stack_child[sp] if d_incl >= stack_child[sp] else 0
+                if calls[s] == 0: first[s] = seen; seen += 1
+                calls[s] += 1; incl[s] += d_incl; excl[s] += d_excl
+                if d_incl > max_incl[s]: max_incl[s] = d_incl
+                if sp > 0: stack_child[sp-1] += d_incl
+                if s == sid[i]: break
+    # close leftover frames at the last timestamp
+    if close_open and n > 0:
+        t = ts[n-1]
+        while sp > 0:
+            sp -= 1
+            s = stack_sid[sp]
+            d_incl = t - stack_start[sp] if t >= stack_start[sp] else 0
+            d_excl = d_incl - stack_child[sp] if d_incl >= stack_child[sp] else 0
+            if calls[s] == 0: first[s] = seen; seen += 1
+            calls[s] += 1; incl[s] += d_incl; excl[s] += d_excl
+            if d_incl > max_incl[s]: max_incl[s] = d_incl
+            if sp > 0: stack_child[sp-1] += d_incl
+    return stack_sid[:sp], stack_start[:sp], stack_child[:sp]
+
+_replay_jit = njit(cache=True)(_replay_kernel) if njit is not None else None
+
+def _replay_py(ts, sid, is_enter, calls, incl, excl, max_incl, first, stack, close_open=True):
+    # Pure Python version of _replay_kernel over plain lists; stack holds the carried
+    # [slot, start_ns, child_ns] frames and is updated in place
+    last_ts = None; seen = 0
+    for ts_ns, slot, e in zip(ts, sid, is_enter):
+        last_ts = ts_ns
+        if e:       # enter
+            stack.append([slot, ts_ns, 0])
+        else:       # exit
+            # Drain until we find a matching frame to handle exceptions/unwinds
             while stack:
-                top_fn, start, child = stack.pop()
-                incl = end_ts - start if end_ts >= start else 0
-                excl = incl - child if incl >= child else 0
-                global_aggs[top_fn] = agg_add(global_aggs.get(top_fn), calls=1, incl=incl, excl=excl, mx=incl)
+                s, start, child = stack.pop()
+                d_incl = ts_ns - start if ts_ns >= start else 0
+                d_excl = d_incl - child if d_incl >= child else 0
+                if not calls[s]: first[s] = seen; seen += 1
+                calls[s] += 1; incl[s] += d_incl; excl[s] += d_excl
+                if d_incl > max_incl[s]: max_incl[s] = d_incl
+                # attribute inclusive time to parent as child time
                 if stack:
-                    stack[-1][2] += incl
+                    stack[-1][2] += d_incl
+                if s == slot:
+                    break
+    # If frames remain (abrupt exit), close them at last_ts to keep totals conservative
+    if close_open and last_ts is not None and stack:
+        end_ts = last_ts
+        while stack:
+            s, start, child = stack.pop()
+            d_incl = end_ts - start if end_ts >= start else 0
+            d_excl = d_incl - child if d_incl >= child else 0
+            if not calls[s]: first[s] = seen; seen += 1
+            calls[s] += 1; incl[s] += d_incl; excl[s] += d_excl
+            if d_incl > max_incl[s]: max_incl[s] = d_incl
+            if stack:
+                stack[-1][2] += d_incl
+
+def _replay_vectorized(ts, sid, is_enter, k, open_sid, open_start, open_child, close_open):
+    # Array-only replay for well-formed traces: an exit closes the latest enter at its
+    # call depth, so sorting by (level, position) pairs enters with exits. Child time is
+    # the incl of level+1 frames inside a frame, read off a prefix sum. Carried open_*
+    # frames replay as a prefix of enters; frames still open at the end are closed at the
+    # last timestamp if close_open, else returned. Returns (five int64 columns, (sid, start,
+    # child) left open), first = position of a slot's first exit; or None on
+    # unwinds/unmatched exits (caller uses the stack replay)
+    cols = [np.zeros(k, np.int64) for _ in range(5)]
+    if len(ts) == 0:
+        return cols, (open_sid, open_start, open_child)
+    n_open = len(open_sid)
+    ts = np.concatenate([open_start, ts]); sid = np.concatenate([open_sid, sid])
+    e = np.concatenate([np.ones(n_open, bool), is_enter.astype(bool)])
+    n = len(ts)
+    depth = np.cumsum(np.where(e, 1, -1))
+    if depth.min() < 0:
+        return None
+    level = np.where(e, depth, depth + 1)
+    pos = np.arange(n)
+    open_d = int(depth[-1])
+    if open_d:  # synthetic exits (innermost first) for frames still open at the end
+        last = np.full(open_d + 1, -1)
+        sel = e & (level <= open_d)
+        np.maximum.at(last, level[sel], pos[sel])
+        ts = np.concatenate([ts, np.full(open_d, ts[-1], ts.dtype)])
+        sid = np.concatenate([sid, sid[last[:0:-1]]])
+        level = np.concatenate([level, np.arange(open_d, 0, -1)])
+        pos = np.arange(n + open_d)
+    order = np.lexsort((pos, level))
+    enter_at, exit_at = order[0::2], order[1::2]
+    if not np.array_equal(sid[enter_at], sid[exit_at]):
+        return None
+    d = ts[exit_at] - ts[enter_at]
+    incl = np.where(d > 0, d, 0)
+    still_open = exit_at >= n
+    if not close_open: incl[still_open] = 0  # not closed yet -> no time for its parent
+    f_level = level[enter_at]
+    key = f_level * (len(pos) + 1) + enter_at
+    prefix = np.concatenate([[0], np.cumsum(incl)])
+    child_base = (f_level + 1) * (len(pos) + 1)
+    child = prefix[np.searchsorted(key, child_base + exit_at)] - prefix[np.searchsorted(key, child_base + enter_at)]
+    carried = enter_at < n_open
+    child[carried] += open_child[enter_at[carried]]
+    excl = np.where(incl >= child, incl - child, 0)
+    if close_open:
+        empty = np.zeros(0, np.int64); left = (empty, empty, empty)
+    else:
+        left = (sid[enter_at[still_open]], ts[enter_at[still_open]], child[still_open])
+        done = ~still_open
+        enter_at, exit_at, incl, excl = enter_at[done], exit_at[done], incl[done], excl[done]
+    f_sid = sid[enter_at]
+    np.add.at(cols[0], f_sid, 1); np.add.at(cols[1], f_sid, incl)
+    np.add.at(cols[2], f_sid, excl); np.maximum.at(cols[3], f_sid, incl)
+    cols[4][:] = len(pos); np.minimum.at(cols[4], f_sid, exit_at)
+    return cols, left
+
+def _reduce_stack(ts_col, fn_col, typ_col, aggs, open_frames=None, final=True):
+    # Replay enter/exit columns through a call stack; per-function totals live in
+    # four columns indexed by a dense slot per unique fn, folded into Aggs at the end
+    # in first-exit order (so dict order, and thus sort ties, match a per-record replay).
+    # open_frames: [addr, start_ns, child_ns] frames carried between chunks of one log
+    # (updated in place); leftovers are only closed on the final chunk
+    if open_frames is None: open_frames = []
+    n_open = len(open_frames)
+    if n_open: fn_col = np.concatenate([np.array([f[0] for f in open_frames], fn_col.dtype), fn_col])
+    addrs, sid = np.unique(fn_col, return_inverse=True)
+    open_sid, sid = sid[:n_open].astype(np.int64), sid[n_open:]
+    open_start = np.array([f[1] for f in open_frames], np.int64); open_child = np.array([f[2] for f in open_frames], np.int64)
+    k = len(addrs)
+    is_enter = (typ_col == 0).view(np.uint8)  # enter/exit classified in one vector pass
+    cols = None
+    if _replay_jit is not None:
+        cols = [np.zeros(k, np.int64) for _ in range(5)]
+        left = _replay_jit(ts_col.astype(np.int64), sid.astype(np.int64), is_enter, int(np.count_nonzero(is_enter)),
+                           open_sid, open_start, open_child, final, *cols)
+    else:
+        res = _replay_vectorized(ts_col.astype(np.int64), sid, is_enter, k, open_sid, open_start, open_child, final)
+        if res is not None: cols, left = res
+    if cols is not None:
+        calls, incl, excl, max_incl, first = (c.tolist() for c in cols)
+        open_frames[:] = [[addrs[s].item(), t, c] for s, t, c in zip(*(a.tolist() for a in left))]
+    else:  # unwinds/unmatched exits need the real stack
+        calls, incl, excl, max_incl, first = [0]*k, [0]*k, [0]*k, [0]*k, [0]*k
+        stack = [[s, f[1], f[2]] for s, f in zip(open_sid.tolist(), open_frames)]
+        _replay_py(ts_col.tolist(), sid.tolist(), is_enter.tolist(), calls, incl, excl, max_incl, first, stack, final)
+        open_frames[:] = [[addrs[s].item(), t, c] for s, t, c in stack]
+    addrs = addrs.tolist()
+    for s in np.argsort(first, kind="stable").tolist():
+        if calls[s]:  # seen only in unmatched exits -> never a frame
+            agg_add(aggs, addrs[s], calls[s], incl[s], excl[s], max_incl[s])
+
+WINDOW = 256 << 20  # bytes mapped at a time; mmap offsets must be allocation-granularity aligned
+assert WINDOW % mmap.ALLOCATIONGRANULARITY == 0
+
+def analyze_thread_file(path, window=WINDOW):
+    # Returns (pid, tid, {addr: [calls, incl, excl, max_incl]}) for one thread log.
+    # Mapped in page-aligned windows so multi-GB logs never need one huge mapping; a window
+    # takes the records starting inside it (mapped one record past its end so a straddling
+    # record is whole) and open frames carry over to the next
+    aggs = new_aggs()
+    open_frames = []
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        nrec = max(size - HEADER_SZ, 0) // RECORD_SZ
+        off = 0
+        while True:
+            first = -(-max(off - HEADER_SZ, 0) // RECORD_SZ)  # first record starting at/after off
+            stop = min(nrec, -(-(off + window - HEADER_SZ) // RECORD_SZ))
+            length = HEADER_SZ + stop * RECORD_SZ - off if off else min(size, HEADER_SZ + stop * RECORD_SZ)
+            mm = mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ, offset=off)
+            try:
+                _advise_sequential(f, mm)
+                if not off: pid, tid, start_ns, flags = load_header(mm)
+                # Parse this window's records in one pass into columns (ts, fn, typ)
+                recs = np.frombuffer(mm, dtype=REC_DTYPE, count=stop - first, offset=HEADER_SZ + first * RECORD_SZ - off)
+                _reduce_stack(recs["ts"], recs["fn"], recs["typ"], aggs, open_frames, stop == nrec)
+            finally:
+                recs = None  # release the buffer so mm can close
+                try: mm.close()
+                except BufferError: pass  # a traceback still holds views; keep the original error
+            if stop == nrec: return pid, tid, aggs
+            off += window
 
 def main():
     ap = argparse.ArgumentParser(description="Analyze fprof logs")
@@ -125,6 +309,7 @@ def main():
     ap.add_argument("--out", default="report.csv", help="Output CSV path")
     ap.add_argument("--top", type=int, default=0, help="Only write top N by exclusive time")
     ap.add_argument("--no-symbols", action="store_true", help="Do not run addr2line; show addresses only")
+    ap.add_argument("--jobs", type=int, default=0, help="Worker processes for parsing logs (0 = CPU count)")
     args = ap.parse_args()
 
     logdir = Path(args.logdir)
@@ -141,58 +326,66 @@ def main():
         maps = parse_maps(maps_files[0])
 
     # 1) Aggregate across all threads
-    aggs = {}  # addr -> Agg
-    for p in bins:
-        try:
-            analyze_thread_file(p, aggs)
-        except Exception as e:
-            print(f"Failed to parse {p}: {e}", file=sys.stderr)
+    aggs = new_aggs()
+    # Each log is independent: parse in worker processes, merge here
+    with ProcessPoolExecutor(max_workers=args.jobs or None) as ex:
+        futures = [(p, ex.submit(analyze_thread_file, p)) for p in bins]
+        for p, fut in futures:
+            try:
+                pid, tid, t_aggs = fut.result()
+            except Exception as e:
+                print(f"Failed to parse {p}: {e}", file=sys.stderr); continue
+            for addr, a in t_aggs.items():
+                agg_add(aggs, addr, *a)
 
     if not aggs:
         print("No events aggregated.", file=sys.stderr); sys.exit(1)
 
-    # 2) Symbolize unique addresses
-    addr_to_module = {}
+    # 2) Symbolize unique addresses. keys/idx/vmas stay aligned: the CSV pass below
+    # indexes them instead of going through a per-address dict
+    keys = list(aggs.keys())
+    paths = [m[3] for m in maps]
+    # vma = runtime address - base_vma, i.e. the link-time VMA addr2line expects
+    idx, vmas = find_modules(maps, np.fromiter(keys, np.uint64, len(keys)))
+    # group addresses by module with one sort; Python only loops once per module
+    # (sets, since several mappings of one file can yield the same VMA)
     module_to_vmas = collections.defaultdict(set)
-    for addr in aggs.keys():
-        m = find_module(maps, addr) if maps else None
-        if m:
-            start,end,off,path,_,base_vma = m
-            vma = addr - base_vma  # convert runtime address to link-time VMA
-            addr_to_module[addr] = (path, vma)
-            module_to_vmas[path].add(vma)
-        else:
-            addr_to_module[addr] = (None, None)
+    hit = np.flatnonzero(idx >= 0)
+    by_mod = hit[np.argsort(idx[hit], kind="stable")]
+    mis, starts = np.unique(idx[by_mod], return_index=True)
+    for mi, mod_vmas in zip(mis.tolist(), np.split(vmas[by_mod], starts[1:])):
+        module_to_vmas[paths[mi]].update(mod_vmas.tolist())
 
     addr_to_name = {}
     if not args.no_symbols and module_to_vmas:
-        for mod, vmas in module_to_vmas.items():
-            sym = symbolize_batch(mod, sorted(vmas))
-            for vma, (fn, fl) in sym.items():
-                addr_to_name[(mod, vma)] = fn
-
-    # 3) Write CSV
-    rows = []
-    for addr, a in aggs.items():
-        mod, vma = addr_to_module.get(addr, (None, None))
-        name = addr_to_name.get((mod, vma))
-        func_disp = name if name else ("0x%x" % addr)
-        mod_disp  = mod if mod else ""
-        avg_incl = a.incl_ns / a.calls if a.calls else 0.0
-        avg_excl = a.excl_ns / a.calls if a.calls else 0.0
-        rows.append((mod_disp, func_disp, a.calls, a.incl_ns, a.excl_ns, int(avg_incl), int(avg_excl), a.max_incl_ns))
-
-    # sort by total exclusive time desc
-    rows.sort(key=lambda r: r[4], reverse=True)
+        # one addr2line per module, run concurrently (the work is in the child processes)
+        with ThreadPoolExecutor(max_workers=min(8, len(module_to_vmas))) as ex:
+            mods = list(module_to_vmas)
+            for mod, sym in zip(mods, ex.map(lambda m: symbolize_batch(m, sorted(module_to_vmas[m])), mods)):
+                for vma, (fn, fl) in sym.items():
+                    addr_to_name[(mod, vma)] = fn
+
+    # 3) Write CSV: order by total exclusive time desc on the aggregate columns and
+    # stream rows straight to the writer instead of building a row list first
+    cols = np.array(list(aggs.values()), np.int64).reshape(-1, 4)  # calls, incl, excl, max_incl
+    order = np.argsort(-cols[:, 2], kind="stable")
     if args.top > 0:
-        rows = rows[:args.top]
+        order = order[:args.top]
 
     with open(args.out, "w", newline="") as f:
         w = csv.writer(f)
         w.writerow(["module","function","calls","total_inclusive_ns","total_exclusive_ns","avg_inclusive_ns","avg_exclusive_ns","max_inclusive_ns"])
-        w.writerows(rows)
+        idx_l, vmas_l = idx.tolist(), vmas.tolist()
+        for i in order.tolist():
+            calls, incl, excl, max_incl = cols[i].tolist()
+            mod = paths[idx_l[i]] if idx_l[i] >= 0 else None
+            name = addr_to_name.get((mod, vmas_l[i])) if mod else None
+            func_disp = name if name else ("0x%x" % keys[i])
+            mod_disp  = mod if mod else ""
+            w.writerow((mod_disp, func_disp, calls, incl, excl,
+                        incl // calls if calls else 0, excl // calls if calls else 0, max_incl))
 
-    print(f"Wrote {args.out} with {len(rows)} rows.")
+    print(f"Wrote {args.out} with {len(order)} rows.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -13,7 +13,11 @@ Columns:
 
 Requirements:
   - Python 3.8+
+  - NumPy (records are parsed in bulk via a structured dtype).
+  - Numba (optional): JIT-compiles the call-stack replay; pure Python otherwise.
   - GNU binutils 'addr2line' available on PATH for symbolization (optional).
+  - pyelftools (optional): resolves names from ELF symbol tables in-process;
+    addr2line is then only run for addresses the symbol table does not cover.
   - Binaries built with '-g' (recommended) to resolve function names.
 
 Typical usage:
@@ -26,6 +30,8 @@ Typical usage:
 
 Notes:
   - If symbolization is disabled or symbols are stripped, function shows as hex address.
+  - Resolved names are cached per module BuildID under ~/.cache/fprof/symbols
+    (see --symbol-cache / --no-symbol-cache), so repeated runs skip symbolization.
   - Sorting defaults to total_exclusive_ns (desc). Use --sort to change.
 """
 
@@ -33,30 +39,67 @@ import argparse
 import collections
 import csv
 import glob
+import itertools
+import json
 import mmap
 import os
 import re
 import struct
 import subprocess
 import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Dict, Tuple, List, Optional, Iterable
+from typing import Dict, Tuple, List, Optional, Iterable, Iterator
+
+import numpy as np
+try:
+    from numba import njit
+except ImportError:  # optional: the stack replay falls back to pure Python
+    njit = None
+try:
+    from elftools.elf.elffile import ELFFile
+except ImportError:  # optional: symbolization goes through addr2line only
+    ELFFile = None
 
 # --- Log format (must match prof_log_fast.cpp) ---
 HEADER_FMT = "<8sIIQII"   # magic(8), pid(u32), tid(u32), start_ns(u64), rec_size(u32), flags(u32)
 RECORD_FMT = "<QQB7x"     # ts(u64), fn(u64), type(u8), pad(7)
-HEADER_SZ  = struct.calcsize(HEADER_FMT)
-RECORD_SZ  = struct.calcsize(RECORD_FMT)
-
-Agg = collections.namedtuple("Agg", "calls incl_ns excl_ns max_incl_ns")
+_HDR       = struct.Struct(HEADER_FMT)  # compiled once; bound methods reused per call
+_REC       = struct.Struct(RECORD_FMT)
+HEADER_SZ  = _HDR.size
+RECORD_SZ  = _REC.size
+# Same layout as RECORD_FMT, for parsing the whole record region in one go
+REC_DTYPE  = np.dtype([("ts", "<u8"), ("fn", "<u8"), ("typ", "u1"), ("pad", "V7")])
+assert REC_DTYPE.itemsize == RECORD_SZ
+
+# Aggregates are stored as mutable [calls, incl_ns, excl_ns, max_incl_ns] lists and
+# merged in place; rows are produced from them column-wise (see sorted_agg_columns).
+AggList = List[int]
+
+def _zero_agg() -> AggList:
+    return [0, 0, 0, 0]
+
+def new_aggs() -> Dict[int, AggList]:
+    """
+    Empty aggregate map. Missing keys start at zero, so agg_add is a single dict
+    lookup per update. The factory is a module-level function so the map still
+    pickles across the worker pool.
+    """
+    return collections.defaultdict(_zero_agg)
 
-def agg_add(a: Optional[Agg], calls=0, incl=0, excl=0, mx=0) -> Agg:
-    if a is None:
-        return Agg(calls, incl, excl, mx)
-    return Agg(a.calls + calls, a.incl_ns + incl, a.excl_ns + excl, max(a.max_incl_ns, mx))
+def agg_add(aggs: Dict, key, calls=0, incl=0, excl=0, mx=0) -> None:
+    a = aggs[key]  # aggs comes from new_aggs()
+    a[0] += calls
+    a[1] += incl
+    a[2] += excl
+    if mx > a[3]:
+        a[3] = mx
 
 
 # --- /proc/<pid>/maps parsing for module & load bias ---
+_MAPS_RE = re.compile(r"\d+\.maps$")  # <pid>.maps saved next to the thread logs
+
 def parse_maps(maps_path: Path):
     """
     Parses an ELF memory map file and returns a list of executable mappings:
@@ -86,125 +129,596 @@ def parse_maps(maps_path: Path):
     mappings.sort(key=lambda m: m[0])
     return mappings
 
-def find_module(mappings, addr: int):
-    """Binary search for the mapping containing 'addr'. Returns mapping tuple or None."""
-    lo, hi = 0, len(mappings) - 1
-    while lo <= hi:
-        mid = (lo + hi) // 2
-        start, end, off, path, base_vma = mappings[mid]
-        if addr < start:
-            hi = mid - 1
-        elif addr >= end:
-            lo = mid + 1
-        else:
-            return mappings[mid]
-    return None
+def find_modules(mappings, addrs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized module lookup for a uint64 array of runtime addresses.
+    Returns (idx, vmas): idx[i] is the index into 'mappings' of the mapping that
+    contains addrs[i] (or -1), and vmas[i] = addrs[i] - base_vma of that mapping
+    (meaningless where idx[i] == -1).
+    """
+    if not mappings:
+        return np.full(len(addrs), -1, np.int64), np.zeros(len(addrs), np.uint64)
+    starts = np.array([m[0] for m in mappings], np.uint64)
+    ends   = np.array([m[1] for m in mappings], np.uint64)
+    bases  = np.array([m[4] for m in mappings], np.uint64)
+    idx = np.searchsorted(starts, addrs, side="right") - 1
+    safe = idx.clip(0)
+    hit = (idx >= 0) & (addrs < ends[safe])
+    return np.where(hit, idx, -1), addrs - bases[safe]
 
 
 # --- Symbolization helpers ---
-def symbolize_batch(module_path: str, vmas: List[int]) -> Dict[int, Tuple[Optional[str], Optional[str]]]:
+# Elf{64,32}_Sym layouts, for reading a whole symbol table section at once
+_ELF_SYM_DTYPES = {
+    64: np.dtype([("name", "u4"), ("info", "u1"), ("other", "u1"), ("shndx", "u2"), ("value", "u8"), ("size", "u8")]),
+    32: np.dtype([("name", "u4"), ("value", "u4"), ("size", "u4"), ("info", "u1"), ("other", "u1"), ("shndx", "u2")]),
+}
+STT_FUNC = 2
+SHN_UNDEF = 0  # imported symbols; their value may be a PLT stub address
+
+# (path, size, mtime_ns) -> (starts, ends, name_offsets, strtab) or None
+_func_symbols_cache: Dict[Tuple[str, int, int], Optional[tuple]] = {}
+
+def _load_func_symbols(module_path: str):
+    """
+    Reads the STT_FUNC symbols of a module's .symtab (falling back to .dynsym) and
+    returns (starts, ends, name_offsets, strtab) sorted by start address, or None if
+    the module has no function symbols. Cached per file identity, so PIDs sharing a
+    module only parse it once.
+    """
+    st = os.stat(module_path)
+    key = (module_path, st.st_size, st.st_mtime_ns)
+    if key in _func_symbols_cache:
+        return _func_symbols_cache[key]
+    table = None
+    with open(module_path, "rb") as f:
+        elf = ELFFile(f)
+        dt = _ELF_SYM_DTYPES[elf.elfclass].newbyteorder("<" if elf.little_endian else ">")
+        for sec_name in (".symtab", ".dynsym"):
+            sec = elf.get_section_by_name(sec_name)
+            if sec is None or sec["sh_entsize"] != dt.itemsize:
+                continue
+            syms = np.frombuffer(sec.data(), dtype=dt)
+            syms = syms[((syms["info"] & 0xF) == STT_FUNC) & (syms["shndx"] != SHN_UNDEF) & (syms["value"] != 0)]
+            if not len(syms):
+                continue
+            # Where symbols share an address keep one, picked like addr2line does: the
+            # largest size (zero counts as one), then the first in table order
+            sizes = np.maximum(syms["size"].astype(np.int64), 1)
+            order = np.lexsort((-sizes, syms["value"]))
+            _, first = np.unique(syms["value"][order], return_index=True)
+            syms, sizes = syms[order[first]], sizes[order[first]]
+            starts = syms["value"].astype(np.uint64)
+            ends = starts + sizes.astype(np.uint64)
+            strtab = elf.get_section(sec["sh_link"]).data()
+            table = (starts, ends, syms["name"].astype(np.int64), strtab)
+            break
+    _func_symbols_cache[key] = table
+    return table
+
+def _demangle(names: List[str]) -> List[str]:
+    """Demangles C++ names with one 'c++filt' run; returns them unchanged if that fails."""
+    if not names:
+        return names
+    try:
+        cp = subprocess.run(["c++filt", "-i"], input="".join(n + "\n" for n in names),
+                            capture_output=True, text=True)
+    except FileNotFoundError:
+        return names
+    out = cp.stdout.splitlines()
+    return out if cp.returncode == 0 and len(out) == len(names) else names
+
+def _symbolize_symtab(module_path: str, vmas: List[int]) -> Dict[int, str]:
+    """Returns vma -> demangled function name for the VMAs covered by a function symbol."""
+    try:
+        table = _load_func_symbols(module_path)
+    except Exception:
+        # Not an ELF file or unreadable: leave everything to addr2line
+        return {}
+    if table is None or not vmas:
+        return {}
+    starts, ends, name_offsets, strtab = table
+    v = np.array(vmas, np.uint64)
+    idx = np.searchsorted(starts, v, side="right") - 1
+    safe = idx.clip(0)
+    hit = np.flatnonzero((idx >= 0) & (v < ends[safe]))
+    raw = []
+    for o in name_offsets[idx[hit]].tolist():
+        raw.append(strtab[o:strtab.index(b"\0", o)].decode("utf-8", errors="replace"))
+    return dict(zip(v[hit].tolist(), _demangle(raw)))
+
+def _addr2line_batch(module_path: str, vmas: List[int]) -> Dict[int, Tuple[Optional[str], Optional[str]]]:
     """
-    Runs 'addr2line -f -C -e <module> <addr>...' and returns:
+    Runs a single 'addr2line -f -C -e <module>' fed with all VMAs on stdin and returns:
       vma -> (function_name or None, file:line or None)
+    One process per module means its DWARF is parsed once, not once per chunk.
     """
     out = {}
-    if not module_path or not os.path.exists(module_path):
-        for v in vmas:
-            out[v] = (None, None)
-        return out
     try:
-        CHUNK = 2048  # avoid overly long argv
-        for i in range(0, len(vmas), CHUNK):
-            chunk = vmas[i:i+CHUNK]
-            cmd = ["addr2line", "-f", "-C", "-e", module_path] + [hex(v) for v in chunk]
-            cp = subprocess.run(cmd, capture_output=True, text=True)
-            if cp.returncode != 0:
-                for v in chunk:
-                    out[v] = (None, None)
-                continue
-            lines = cp.stdout.splitlines()
-            for j, v in enumerate(chunk):
-                # addr2line emits pairs: function\nfile:line\n
-                fn = lines[2*j] if 2*j   < len(lines) else "??"
-                fl = lines[2*j+1] if 2*j+1 < len(lines) else "??:0"
-                out[v] = (fn if fn != "??" else None, fl if fl != "??:0" else None)
-        return out
+        cp = subprocess.run(["addr2line", "-f", "-C", "-e", module_path],
+                            input="".join(f"{v:#x}\n" for v in vmas),
+                            capture_output=True, text=True)
     except FileNotFoundError:
         # addr2line missing
         return {v: (None, None) for v in vmas}
+    if cp.returncode != 0:
+        return {v: (None, None) for v in vmas}
+    lines = cp.stdout.splitlines()
+    for j, v in enumerate(vmas):
+        # addr2line emits pairs: function\nfile:line\n
+        fn = lines[2*j] if 2*j   < len(lines) else "??"
+        fl = lines[2*j+1] if 2*j+1 < len(lines) else "??:0"
+        out[v] = (fn if fn != "??" else None, fl if fl != "??:0" else None)
+    return out
+
+def symbolize_batch(module_path: str, vmas: List[int]) -> Dict[int, Tuple[Optional[str], Optional[str]]]:
+    """
+    Resolves VMAs of one module and returns:
+      vma -> (function_name or None, file:line or None)
+    With pyelftools installed, names are looked up in-process in the module's ELF
+    symbol table (file:line is then None); only the VMAs it misses go to addr2line.
+    """
+    if not module_path or not os.path.exists(module_path):
+        return {v: (None, None) for v in vmas}
+    out: Dict[int, Tuple[Optional[str], Optional[str]]] = {}
+    if ELFFile is not None:
+        out = {v: (name, None) for v, name in _symbolize_symtab(module_path, vmas).items()}
+    rest = [v for v in vmas if v not in out]
+    if rest:
+        out.update(_addr2line_batch(module_path, rest))
+    return out
+
+
+PT_NOTE = 4
+NT_GNU_BUILD_ID = 3
+
+def read_build_id(module_path: str) -> Optional[str]:
+    """Returns the hex NT_GNU_BUILD_ID note of an ELF file (from its PT_NOTE segments), or None."""
+    try:
+        with open(module_path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        if mm[:4] != b"\x7fELF":
+            return None
+        is64 = mm[4] == 2
+        e = "<" if mm[5] == 1 else ">"
+        word = struct.Struct(e + ("Q" if is64 else "I")).unpack_from  # Elf_Addr / Elf_Off size
+        u32 = struct.Struct(e + "I").unpack_from
+        note_hdr = struct.Struct(e + "III").unpack_from
+        (phoff,) = word(mm, 0x20 if is64 else 0x1C)
+        phentsize, phnum = struct.unpack_from(e + "HH", mm, 0x36 if is64 else 0x2A)
+        for i in range(phnum):
+            ph = phoff + i * phentsize
+            (p_type,) = u32(mm, ph)
+            if p_type != PT_NOTE:
+                continue
+            (off,) = word(mm, ph + (8 if is64 else 4))
+            (size,) = word(mm, ph + (32 if is64 else 16))
+            pos, end = off, off + size
+            while pos + 12 <= end:
+                namesz, descsz, ntype = note_hdr(mm, pos)
+                desc = pos + 12 + ((namesz + 3) & ~3)
+                if ntype == NT_GNU_BUILD_ID and mm[pos + 12:pos + 12 + namesz] == b"GNU\0":
+                    return mm[desc:desc + descsz].hex()
+                pos = desc + ((descsz + 3) & ~3)
+        return None
+    except (struct.error, IndexError):
+        return None
+    finally:
+        mm.close()
+
+def default_symbol_cache_dir() -> Path:
+    return Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "fprof" / "symbols"
+
+# Bump whenever symbolize_batch may return a different name for the same VMA, so
+# cache files written by older code are discarded instead of served.
+SYMBOL_CACHE_VERSION = 1
+
+def _symbol_resolver() -> str:
+    """Names the lookup chain symbolize_batch uses in this environment."""
+    return "symtab+addr2line" if ELFFile is not None else "addr2line"
+
+def symbolize_cached(module_path: str, vmas: List[int],
+                     cache_dir: Optional[Path]) -> Dict[int, Tuple[Optional[str], Optional[str]]]:
+    """
+    symbolize_batch() backed by an on-disk cache at <cache_dir>/<build_id>.json,
+    so a module's names are resolved once across runs. Only resolved names are
+    stored; modules without a BuildID (or cache_dir=None) are not cached.
+
+    The file holds {"version": SYMBOL_CACHE_VERSION, <resolver>: {vma: [name, file:line]}}.
+    Entries are kept per resolver, so a run only reuses names produced the way it
+    would produce them itself; files of another version are ignored and rewritten.
+    """
+    build_id = read_build_id(module_path) if cache_dir is not None and module_path else None
+    if build_id is None:
+        return symbolize_batch(module_path, vmas)
+
+    resolver = _symbol_resolver()
+    cache_path = cache_dir / f"{build_id}.json"
+    doc: Dict = {}
+    cached: Dict[int, Tuple[Optional[str], Optional[str]]] = {}
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            doc = json.load(f)
+        if doc.get("version") != SYMBOL_CACHE_VERSION:
+            doc = {}
+        cached = {int(k): tuple(v) for k, v in doc.get(resolver, {}).items()}
+    except (OSError, ValueError, TypeError, AttributeError):
+        doc = {}  # missing, unreadable or outdated cache: start fresh
+
+    missing = [v for v in vmas if v not in cached]
+    if missing:
+        fresh = {v: r for v, r in symbolize_batch(module_path, missing).items() if r[0] is not None}
+        if fresh:
+            cached.update(fresh)
+            doc["version"] = SYMBOL_CACHE_VERSION
+            doc[resolver] = {str(k): list(v) for k, v in cached.items()}
+            try:
+                cache_dir.mkdir(parents=True, exist_ok=True)
+                # Unique temp name: module paths sharing a BuildID may be written concurrently
+                with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=cache_dir,
+                                                 prefix=f"{build_id}.", suffix=".tmp",
+                                                 delete=False) as f:
+                    json.dump(doc, f)
+                os.replace(f.name, cache_path)
+            except OSError as e:
+                print(f"Warning: failed to write symbol cache {cache_path}: {e}", file=sys.stderr)
+    return {v: cached.get(v, (None, None)) for v in vmas}
 
 
 # --- Binary reader ---
 def load_header(mm: mmap.mmap) -> Tuple[int, int, int, int]:
-    hdr = mm[:HEADER_SZ]
-    if len(hdr) != HEADER_SZ:
+    if len(mm) < HEADER_SZ:
         raise RuntimeError("bad header length")
-    magic, pid, tid, start_ns, rec_size, flags = struct.unpack(HEADER_FMT, hdr)
+    magic, pid, tid, start_ns, rec_size, flags = _HDR.unpack_from(mm, 0)
     if magic[:7] != b"FPROFv1":
         raise RuntimeError("bad magic in {}".format(magic))
     if rec_size != RECORD_SZ:
         raise RuntimeError(f"record size mismatch: file={rec_size}, expected={RECORD_SZ}")
     return pid, tid, start_ns, flags
 
-def analyze_thread_file(bin_path: Path) -> Tuple[int, int, Dict[int, Agg]]:
+def _advise_sequential(f, mm: mmap.mmap) -> None:
+    """
+    Tells the kernel the log is scanned front to back so it uses large readahead
+    windows. MADV_SEQUENTIAL and MADV_WILLNEED are distinct advice values (not
+    bit flags), so they are issued separately. Hints only: failures are ignored.
+    """
+    try:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+        if hasattr(mmap, "MADV_WILLNEED"):
+            mm.madvise(mmap.MADV_WILLNEED)
+    except OSError:
+        pass
+
+def _replay_kernel(ts, sid, is_enter, n_enter, open_sid, open_start, open_child, close_open,
+                   calls, incl, excl, max_incl, first):
+    """
+    Call-stack replay over one thread's events, written for Numba's nopython mode.
+    'sid' holds a dense slot id per record (index into the unique fn addresses) and
+    'is_enter' is the precomputed 0/1 event class; per-slot totals are accumulated
+    into the calls/incl/excl/max_incl columns.
+    first[s] ranks the slots by their first exit, which is the order in which the
+    plain stack replay inserts them into the aggregate dict.
+
+    The stack starts from the open_* frames (carried over from the previous chunk of
+    the same log). Unless close_open is set, frames still open at the end are
+    returned as (sid, start, child) arrays instead of being closed.
+    """
+    n = ts.shape[0]
+    cap = open_sid.shape[0] + n_enter + 1  # depth never exceeds carried frames + enters
+    stack_sid = np.empty(cap, np.int64)
+    stack_start = np.empty(cap, np.int64)
+    stack_child = np.empty(cap, np.int64)
+    sp = open_sid.shape[0]
+    stack_sid[:sp] = open_sid
+    stack_start[:sp] = open_start
+    stack_child[:sp] = open_child
+    seen = 0
+    for i in range(n):
+        t = ts[i]
+        e = is_enter[i]
+        # Store the frame unconditionally and bump sp by the enter bit, so the
+        # enter path has no branch; on an exit the slot above the top is scratch.
+        stack_sid[sp] = sid[i]
+        stack_start[sp] = t
+        stack_child[sp] = 0
+        sp += e
+        if e == 0:  # exit
+            # Drain until match to handle exception unwinds
+            while sp > 0:
+                sp -= 1
+                s = stack_sid[sp]
+                d_incl = t - stack_start[sp] if t >= stack_start[sp] else 0
+                d_excl = d_incl - stack_child[sp] if d_incl >= stack_child[sp] else 0
+                if calls[s] == 0:
+                    first[s] = seen
+                    seen += 1
+                calls[s] += 1
+                incl[s] += d_incl
+                excl[s] += d_excl
+                if d_incl > max_incl[s]:
+                    max_incl[s] = d_incl
+                if sp > 0:
+                    stack_child[sp - 1] += d_incl
+                if s == sid[i]:
+                    break
+    # If frames remain (abrupt termination), close at last_ts conservatively
+    if close_open and n > 0:
+        t = ts[n - 1]
+        while sp > 0:
+            sp -= 1
+            s = stack_sid[sp]
+            d_incl = t - stack_start[sp] if t >= stack_start[sp] else 0
+            d_excl = d_incl - stack_child[sp] if d_incl >= stack_child[sp] else 0
+            if calls[s] == 0:
+                first[s] = seen
+                seen += 1
+            calls[s] += 1
+            incl[s] += d_incl
+            excl[s] += d_excl
+            if d_incl > max_incl[s]:
+                max_incl[s] = d_incl
+            if sp > 0:
+                stack_child[sp - 1] += d_incl
+    return stack_sid[:sp], stack_start[:sp], stack_child[:sp]
+
+_replay_jit = njit(cache=True)(_replay_kernel) if njit is not None else None
+
+def _replay_py(ts, sid, is_enter, calls, incl, excl, max_incl, first,
+               stack: List[List[int]], close_open: bool = True) -> None:
+    """
+    Pure Python counterpart of _replay_kernel, operating on plain lists. 'stack'
+    holds the carried [slot, start_ns, child_ns] frames and is updated in place.
+    """
+    last_ts = None
+    seen = 0
+
+    for ts_ns, slot, e in zip(ts, sid, is_enter):
+        last_ts = ts_ns
+        if e:  # enter
+            stack.append([slot, ts_ns, 0])
+        else:  # exit
+            # Drain until match to handle exception unwinds
+            while stack:
+                s, start, child = stack.pop()
+                d_incl = ts_ns - start if ts_ns >= start else 0
+                d_excl = d_incl - child if d_incl >= child else 0
+                if not calls[s]:
+                    first[s] = seen
+                    seen += 1
+                calls[s] += 1
+                incl[s] += d_incl
+                excl[s] += d_excl
+                if d_incl > max_incl[s]:
+                    max_incl[s] = d_incl
+                if stack:
+                    stack[-1][2] += d_incl
+                if s == slot:
+                    break
+    # If frames remain (abrupt termination), close at last_ts conservatively
+    if close_open and last_ts is not None and stack:
+        end_ts = last_ts
+        while stack:
+            s, start, child = stack.pop()
+            d_incl = end_ts - start if end_ts >= start else 0
+            d_excl = d_incl - child if d_incl >= child else 0
+            if not calls[s]:
+                first[s] = seen
+                seen += 1
+            calls[s] += 1
+            incl[s] += d_incl
+            excl[s] += d_excl
+            if d_incl > max_incl[s]:
+                max_incl[s] = d_incl
+            if stack:
+                stack[-1][2] += d_incl
+
+def _replay_vectorized(ts: np.ndarray, sid: np.ndarray, is_enter: np.ndarray, k: int,
+                       open_sid: np.ndarray, open_start: np.ndarray, open_child: np.ndarray,
+                       close_open: bool):
+    """
+    Array-only replay for well-formed traces (every exit closes the innermost open
+    frame). Frames are matched by call depth: an exit closes the latest enter at its
+    level, so sorting records by (level, position) pairs each enter with its exit.
+    Child time of a frame is the inclusive time of the level+1 frames entered inside
+    it, read off a prefix sum.
+
+    Carried open_* frames are replayed as a prefix of enters at their start times.
+    Frames still open at the end are closed at the last timestamp when close_open
+    is set, like the stack replay does; otherwise they are returned to be carried.
+
+    Returns ((calls, incl, excl, max_incl, first), (sid, start, child)): int64
+    columns of length k and the frames left open, outermost first. first[s] is the
+    position of slot s's first exit, so it ranks slots like the stack replay's
+    first-exit counter does. Returns None if the trace has unwinds/unmatched exits
+    and needs the stack replay instead.
+    """
+    cols = [np.zeros(k, np.int64) for _ in range(5)]
+    if len(ts) == 0:
+        return cols, (open_sid, open_start, open_child)
+    n_open = len(open_sid)
+    ts = np.concatenate([open_start, ts])
+    sid = np.concatenate([open_sid, sid])
+    e = np.concatenate([np.ones(n_open, bool), is_enter.astype(bool)])
+    n = len(ts)
+    depth = np.cumsum(np.where(e, 1, -1))
+    if depth.min() < 0:
+        return None  # exit with nothing open
+    level = np.where(e, depth, depth + 1)
+    pos = np.arange(n)
+
+    open_d = int(depth[-1])
+    if open_d:
+        # The frame open at level L is the last enter at that level; append
+        # synthetic exits for them, innermost first, at the last timestamp.
+        last = np.full(open_d + 1, -1)
+        sel = e & (level <= open_d)
+        np.maximum.at(last, level[sel], pos[sel])
+        closing = last[:0:-1]
+        ts = np.concatenate([ts, np.full(open_d, ts[-1], ts.dtype)])
+        sid = np.concatenate([sid, sid[closing]])
+        level = np.concatenate([level, np.arange(open_d, 0, -1)])
+        pos = np.arange(n + open_d)
+
+    order = np.lexsort((pos, level))  # by level, then position: enter, exit, enter, ...
+    enter_at, exit_at = order[0::2], order[1::2]
+    if not np.array_equal(sid[enter_at], sid[exit_at]):
+        return None  # an exit for a different function: exception unwind
+
+    d = ts[exit_at] - ts[enter_at]
+    incl = np.where(d > 0, d, 0)
+    still_open = exit_at >= n  # closed by a synthetic exit
+    if not close_open:
+        incl[still_open] = 0  # no time yet; the parent only counts it once it closes
+    f_level = level[enter_at]
+    key = f_level * (len(pos) + 1) + enter_at  # frames are sorted by this already
+    prefix = np.concatenate([[0], np.cumsum(incl)])
+    child_base = (f_level + 1) * (len(pos) + 1)
+    child = (prefix[np.searchsorted(key, child_base + exit_at)]
+             - prefix[np.searchsorted(key, child_base + enter_at)])
+    carried = enter_at < n_open
+    child[carried] += open_child[enter_at[carried]]
+    excl = np.where(incl >= child, incl - child, 0)
+
+    if close_open:
+        empty = np.zeros(0, np.int64)
+        left = (empty, empty, empty)
+    else:
+        left = (sid[enter_at[still_open]], ts[enter_at[still_open]], child[still_open])
+        done = ~still_open
+        enter_at, exit_at, incl, excl = enter_at[done], exit_at[done], incl[done], excl[done]
+
+    f_sid = sid[enter_at]
+    calls, incl_tot, excl_tot, max_incl, first = cols
+    np.add.at(calls, f_sid, 1)
+    np.add.at(incl_tot, f_sid, incl)
+    np.add.at(excl_tot, f_sid, excl)
+    np.maximum.at(max_incl, f_sid, incl)
+    first[:] = len(pos)
+    np.minimum.at(first, f_sid, exit_at)
+    return cols, left
+
+def _reduce_stack(ts_col: np.ndarray, fn_col: np.ndarray, typ_col: np.ndarray,
+                  aggs: Dict[int, AggList], open_frames: Optional[List[List[int]]] = None,
+                  final: bool = True) -> None:
+    """
+    Replays the enter/exit columns of one thread log through a call stack and
+    folds per-function totals into 'aggs'.
+
+    Totals are kept as four columns (calls, incl, excl, max_incl) indexed by a
+    dense slot per unique fn address and only folded into 'aggs' at the end. They
+    are folded in first-exit order, so 'aggs' (and ties in the sorted CSVs) come
+    out in the order a per-record dict update would produce.
+
+    A log read in several chunks passes the same 'open_frames' list to each call:
+    it holds the [addr, start_ns, child_ns] frames open at the end of the previous
+    chunk and is updated in place. Leftover frames are only closed when 'final'.
+    """
+    if open_frames is None:
+        open_frames = []
+    n_open = len(open_frames)
+    if n_open:  # carried frames need slots too
+        fn_col = np.concatenate([np.array([f[0] for f in open_frames], fn_col.dtype), fn_col])
+    addrs, sid = np.unique(fn_col, return_inverse=True)
+    open_sid, sid = sid[:n_open].astype(np.int64), sid[n_open:]
+    open_start = np.array([f[1] for f in open_frames], np.int64)
+    open_child = np.array([f[2] for f in open_frames], np.int64)
+    k = len(addrs)
+    # Classify enter (typ == 0) vs exit (anything else) in one vectorized pass
+    is_enter = (typ_col == 0).view(np.uint8)
+    cols = None
+    if _replay_jit is not None:
+        cols = [np.zeros(k, np.int64) for _ in range(5)]
+        left = _replay_jit(ts_col.astype(np.int64), sid.astype(np.int64), is_enter,
+                           int(np.count_nonzero(is_enter)), open_sid, open_start, open_child,
+                           final, *cols)
+    else:
+        res = _replay_vectorized(ts_col.astype(np.int64), sid, is_enter, k,
+                                 open_sid, open_start, open_child, final)
+        if res is not None:
+            cols, left = res
+    if cols is not None:
+        calls, incl, excl, max_incl, first = (c.tolist() for c in cols)
+        left_sid, left_start, left_child = (c.tolist() for c in left)
+        open_frames[:] = [[addrs[s].item(), t, c] for s, t, c in zip(left_sid, left_start, left_child)]
+    else:
+        calls, incl, excl, max_incl, first = [0] * k, [0] * k, [0] * k, [0] * k, [0] * k
+        stack = [[s, f[1], f[2]] for s, f in zip(open_sid.tolist(), open_frames)]
+        _replay_py(ts_col.tolist(), sid.tolist(), is_enter.tolist(), calls, incl, excl, max_incl,
+                   first, stack, final)
+        open_frames[:] = [[addrs[s].item(), t, c] for s, t, c in stack]
+
+    addrs = addrs.tolist()
+    for s in np.argsort(first, kind="stable").tolist():
+        if calls[s]:  # addresses only ever seen in unmatched exits never form a frame
+            agg_add(aggs, addrs[s], calls[s], incl[s], excl[s], max_incl[s])
+
+# Records are mapped this many bytes at a time, so a multi-GB log never needs one
+# huge mapping; mmap offsets must be multiples of the allocation granularity.
+WINDOW = 256 << 20
+assert WINDOW % mmap.ALLOCATIONGRANULARITY == 0
+
+def analyze_thread_file(bin_path: Path, window: int = WINDOW) -> Tuple[int, int, Dict[int, AggList]]:
     """
     Reconstructs per-function aggregates for a single thread log.
-    Returns (pid, tid, {addr: Agg})
+    Returns (pid, tid, {addr: [calls, incl_ns, excl_ns, max_incl_ns]})
+
+    The file is mapped in 'window'-sized, page-aligned pieces. Each piece takes the
+    records that start inside it; the mapping runs one record past the window so a
+    record straddling the boundary is parsed whole. Open stack frames carry over to
+    the next piece.
     """
-    aggs: Dict[int, Agg] = {}
+    aggs = new_aggs()
+    open_frames: List[List[int]] = []
     with open(bin_path, "rb") as f:
-        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
-        try:
-            pid, tid, start_ns, flags = load_header(mm)
-            pos = HEADER_SZ
-            end = mm.size()
-            stack: List[List[int]] = []  # [fn_addr, start_ns, child_ns]
-            last_ts = None
-
-            while pos + RECORD_SZ <= end:
-                ts_ns, fn, typ = struct.unpack_from(RECORD_FMT, mm, pos)
-                pos += RECORD_SZ
-                last_ts = ts_ns
-                if typ == 0:  # enter
-                    stack.append([fn, ts_ns, 0])
-                else:  # exit
-                    # Drain until match to handle exception unwinds
-                    while stack:
-                        top_fn, start, child = stack.pop()
-                        incl = ts_ns - start if ts_ns >= start else 0
-                        excl = incl - child if incl >= child else 0
-                        aggs[top_fn] = agg_add(aggs.get(top_fn), calls=1, incl=incl, excl=excl, mx=incl)
-                        if stack:
-                            stack[-1][2] += incl
-                        if top_fn == fn:
-                            break
-            # If frames remain (abrupt termination), close at last_ts conservatively
-            if last_ts is not None and stack:
-                end_ts = last_ts
-                while stack:
-                    top_fn, start, child = stack.pop()
-                    incl = end_ts - start if end_ts >= start else 0
-                    excl = incl - child if incl >= child else 0
-                    aggs[top_fn] = agg_add(aggs.get(top_fn), calls=1, incl=incl, excl=excl, mx=incl)
-                    if stack:
-                        stack[-1][2] += incl
-
-            return pid, tid, aggs
-        finally:
-            mm.close()
+        size = os.fstat(f.fileno()).st_size
+        nrec = max(size - HEADER_SZ, 0) // RECORD_SZ
+        off = 0
+        while True:
+            first = -(-max(off - HEADER_SZ, 0) // RECORD_SZ)  # first record starting at/after off
+            stop = min(nrec, -(-(off + window - HEADER_SZ) // RECORD_SZ))
+            length = HEADER_SZ + stop * RECORD_SZ - off if off else min(size, HEADER_SZ + stop * RECORD_SZ)
+            mm = mmap.mmap(f.fileno(), length, access=mmap.ACCESS_READ, offset=off)
+            try:
+                _advise_sequential(f, mm)
+                if not off:
+                    pid, tid, start_ns, flags = load_header(mm)
+                # One C-level parse of this window's records into columns (ts, fn, typ)
+                recs = np.frombuffer(mm, dtype=REC_DTYPE, count=stop - first,
+                                     offset=HEADER_SZ + first * RECORD_SZ - off)
+                _reduce_stack(recs["ts"], recs["fn"], recs["typ"], aggs, open_frames, stop == nrec)
+            finally:
+                recs = None  # drop the buffer export so mm can be closed
+                try:
+                    mm.close()
+                except BufferError:
+                    pass  # a traceback still holds views; let the original error propagate
+            if stop == nrec:
+                return pid, tid, aggs
+            off += window
 
 
 # --- Aggregation & Reporting ---
-def merge_aggs(dst: Dict[int, Agg], src: Dict[int, Agg]) -> None:
+def merge_aggs(dst: Dict[int, AggList], src: Dict[int, AggList]) -> None:
     for addr, a in src.items():
-        dst[addr] = agg_add(dst.get(addr), calls=a.calls, incl=a.incl_ns, excl=a.excl_ns, mx=a.max_incl_ns)
+        agg_add(dst, addr, *a)
 
 def build_symbol_cache(
     per_pid_addr_sets: Dict[int, Iterable[int]],
     pid_to_maps: Dict[int, List[Tuple[int,int,int,str,int]]],
-    no_symbols: bool
+    no_symbols: bool,
+    cache_dir: Optional[Path] = None,
+    symbolize_sets: Optional[Dict[int, set]] = None
 ):
     """
+    Names are looked up through symbolize_cached(cache_dir); pass None to skip the disk cache.
+    If symbolize_sets is given, only those addresses (per PID) get names; every address
+    is still mapped to its module.
     Returns two dicts:
       addr2modvma[(pid, addr)] = (module_path or "", vma or None)
       name_cache[(pid, module_path, vma)] = demangled_name or None
@@ -215,54 +729,128 @@ def build_symbol_cache(
     # First, map every address to (module, vma) using maps
     module_addr_sets: Dict[Tuple[int,str], set] = collections.defaultdict(set)
     for pid, addrs in per_pid_addr_sets.items():
-        maps = pid_to_maps.get(pid)
-        for addr in addrs:
-            mod_path = ""
-            vma = None
-            if maps:
-                m = find_module(maps, addr)
-                if m:
-                    start, end, off, path, base_vma = m
-                    mod_path = path or ""
-                    vma = addr - base_vma
+        maps = pid_to_maps.get(pid) or []
+        addr_list = list(addrs)
+        wanted = symbolize_sets.get(pid, set()) if symbolize_sets is not None else None
+        # One searchsorted over all of this PID's addresses instead of a bisect per address
+        idx, vmas = find_modules(maps, np.fromiter(addr_list, np.uint64, len(addr_list)))
+        for addr, mi, vma in zip(addr_list, idx.tolist(), vmas.tolist()):
+            if mi >= 0:
+                mod_path = maps[mi][3] or ""
+                if wanted is None or addr in wanted:
                     module_addr_sets[(pid, mod_path)].add(vma)
-            addr2modvma[(pid, addr)] = (mod_path, vma)
-
-    # Then, run addr2line per (pid,module) to get names
-    if not no_symbols:
-        for (pid, mod_path), vmas in module_addr_sets.items():
-            if not mod_path or not vmas:
-                continue
-            sym = symbolize_batch(mod_path, sorted(vmas))
-            for v, (fn, _fl) in sym.items():
-                name_cache[(pid, mod_path, v)] = fn
+                addr2modvma[(pid, addr)] = (mod_path, vma)
+            else:
+                addr2modvma[(pid, addr)] = ("", None)
+
+    # Then, symbolize once per module path (PIDs sharing a module share the work).
+    # Modules are independent and the heavy lifting happens in child processes, so
+    # threads are enough to overlap them.
+    jobs: Dict[str, set] = collections.defaultdict(set)
+    pids_of: Dict[str, List[int]] = collections.defaultdict(list)
+    for (pid, mod_path), vmas in module_addr_sets.items():
+        if mod_path and vmas:
+            jobs[mod_path] |= vmas
+            pids_of[mod_path].append(pid)
+    if not no_symbols and jobs:
+        with ThreadPoolExecutor(max_workers=min(8, len(jobs))) as ex:
+            futures = {ex.submit(symbolize_cached, mod_path, sorted(vmas), cache_dir): mod_path
+                       for mod_path, vmas in jobs.items()}
+            for fut in as_completed(futures):
+                mod_path = futures[fut]
+                sym = fut.result()
+                for pid in pids_of[mod_path]:
+                    for v in module_addr_sets[(pid, mod_path)]:
+                        name_cache[(pid, mod_path, v)] = sym[v][0]
 
     return addr2modvma, name_cache
 
+SORT_COLUMNS = {"exclusive": 2, "inclusive": 1, "calls": 0}  # index into [calls, incl, excl, max]
+
+def _sorted_order(cols: np.ndarray, sort_by: str, top_n: int) -> np.ndarray:
+    """Row indices by the sort column, descending (ties keep dict order), cut to top_n (0 = all)."""
+    order = np.argsort(-cols[:, SORT_COLUMNS[sort_by]], kind="stable")
+    return order[:top_n] if top_n > 0 else order
+
+def top_keys(aggs: Dict, sort_by: str, top_n: int) -> List:
+    """Keys of the rows a CSV of 'aggs' would contain, in output order."""
+    keys = list(aggs.keys())
+    cols = np.array(list(aggs.values()), np.int64).reshape(-1, 4)
+    return [keys[i] for i in _sorted_order(cols, sort_by, top_n).tolist()]
+
+def sorted_agg_columns(aggs: Dict, sort_by: str, top_n: int):
+    """
+    Lays the aggregates out as int64 columns, orders them by the sort column
+    (descending, ties keep dict order) and keeps the first top_n (0 = all).
+    Returns (keys, calls, incl, excl, avg_incl, avg_excl, max_incl) as parallel lists.
+    """
+    keys = list(aggs.keys())
+    cols = np.array(list(aggs.values()), np.int64).reshape(-1, 4)
+    calls, incl, excl, max_incl = cols.T
+    nz = np.maximum(calls, 1)
+    avg_incl = np.where(calls > 0, incl // nz, 0)
+    avg_excl = np.where(calls > 0, excl // nz, 0)
+
+    order = _sorted_order(cols, sort_by, top_n)
+    return ([keys[i] for i in order.tolist()],
+            calls[order].tolist(), incl[order].tolist(), excl[order].tolist(),
+            avg_incl[order].tolist(), avg_excl[order].tolist(), max_incl[order].tolist())
+
+def symbol_addr_sets(
+    per_thread: Dict[Tuple[int,int], Dict[int, AggList]],
+    per_pid_combined: Dict[int, Dict[int, AggList]],
+    global_combined: Dict[Tuple[int,int], AggList],
+    sort_by: str,
+    top_n: int,
+    min_ns: int
+) -> Dict[int, set]:
+    """
+    Returns the addresses worth symbolizing per PID. With min_ns > 0, functions with
+    no exclusive time whose per-PID inclusive total is below min_ns are skipped (they
+    keep their hex address). With top_n > 0, only addresses that make the top rows of
+    at least one CSV are kept, since no other row is ever written.
+    """
+    sets: Dict[int, set] = {}
+    for pid, aggs in per_pid_combined.items():
+        if min_ns > 0:
+            sets[pid] = {addr for addr, a in aggs.items() if a[2] > 0 or a[1] >= min_ns}
+        else:
+            sets[pid] = set(aggs)
+    if top_n > 0:
+        shown: Dict[int, set] = collections.defaultdict(set)
+        for pid, aggs in per_pid_combined.items():
+            shown[pid].update(top_keys(aggs, sort_by, top_n))
+        for (pid, _tid), aggs in per_thread.items():
+            shown[pid].update(top_keys(aggs, sort_by, top_n))
+        for pid, addr in top_keys(global_combined, sort_by, top_n):
+            shown[pid].add(addr)
+        sets = {pid: addrs & shown[pid] for pid, addrs in sets.items()}
+    return sets
+
 def rows_from_aggs(
-    pid: int,
-    aggs: Dict[int, Agg],
+    pid: Optional[int],
+    aggs: Dict,
     addr2modvma: Dict[Tuple[int,int], Tuple[str, Optional[int]]],
     name_cache: Dict[Tuple[int,str,int], Optional[str]],
     sort_by: str,
     top_n: int
-):
-    rows = []
-    for addr, a in aggs.items():
-        mod, vma = addr2modvma.get((pid, addr), ("", None))
-        name = name_cache.get((pid, mod, vma)) if (vma is not None) else None
+) -> Iterator[List]:
+    """
+    Yields CSV rows for 'aggs' in sort order, so writers never hold the full row list.
+    With pid=None the keys are (pid, addr) (the global view) and the module column is
+    prefixed with "[pid N]" to keep rows from different processes apart.
+    """
+    keys, *cols = sorted_agg_columns(aggs, sort_by, top_n)
+    for key, calls, incl, excl, avg_incl, avg_excl, max_incl in zip(keys, *cols):
+        row_pid, addr = key if pid is None else (pid, key)
+        mod, vma = addr2modvma.get((row_pid, addr), ("", None))
+        name = name_cache.get((row_pid, mod, vma)) if (vma is not None) else None
         func_disp = name if name else f"0x{addr:x}"
-        avg_incl = int(a.incl_ns / a.calls) if a.calls else 0
-        avg_excl = int(a.excl_ns / a.calls) if a.calls else 0
-        rows.append([mod, func_disp, a.calls, a.incl_ns, a.excl_ns, avg_incl, avg_excl, a.max_incl_ns])
+        if pid is None:
+            mod = f"[pid {row_pid}] {mod}" if mod else f"[pid {row_pid}]"
+        yield [mod, func_disp, calls, incl, excl, avg_incl, avg_excl, max_incl]
 
-    key_idx = {"exclusive": 4, "inclusive": 3, "calls": 2}[sort_by]
-    rows.sort(key=lambda r: r[key_idx], reverse=True)
-    if top_n > 0:
-        rows = rows[:top_n]
-    return rows
-
-def write_csv(out_path: Path, rows: List[List], header=True):
+def write_csv(out_path: Path, rows: Iterable[List], header=True):
     out_path.parent.mkdir(parents=True, exist_ok=True)
     with open(out_path, "w", newline="") as f:
         w = csv.writer(f)
@@ -283,8 +871,16 @@ def main():
                     help="Output prefix (default: report). Files like <prefix>_combined.csv, <prefix>_pid_<pid>_tid_<tid>.csv")
     ap.add_argument("--top", type=int, default=0, help="Only include top N rows per CSV (0 = all).")
     ap.add_argument("--no-symbols", action="store_true", help="Skip addr2line lookups; print addresses.")
+    ap.add_argument("--symbol-cache", default=str(default_symbol_cache_dir()),
+                    help="Directory for the per-BuildID symbol cache (default: %(default)s).")
+    ap.add_argument("--no-symbol-cache", action="store_true", help="Do not read or write the symbol cache.")
+    ap.add_argument("--symbolize-min-ns", type=int, default=0,
+                    help="Leave functions with zero exclusive time whose per-PID inclusive total "
+                         "is below this many ns as hex addresses (default: 0 = symbolize all).")
     ap.add_argument("--sort", choices=["exclusive", "inclusive", "calls"], default="exclusive",
                     help="Sort key for CSVs (default: exclusive).")
+    ap.add_argument("--jobs", type=int, default=0,
+                    help="Worker processes used to parse thread logs (default: 0 = CPU count).")
     args = ap.parse_args()
 
     logdir = Path(args.logdir)
@@ -297,35 +893,38 @@ def main():
         print(f"No .bin logs found in {logdir}", file=sys.stderr)
         sys.exit(1)
 
-    # Parse all threads
-    per_thread: Dict[Tuple[int,int], Dict[int, Agg]] = {}  # (pid,tid) -> {addr -> Agg}
+    # Parse all threads, folding each result into its per-PID totals as it arrives
+    # (a single merge pass; the global view is derived from the per-PID dicts later).
+    per_thread: Dict[Tuple[int,int], Dict[int, AggList]] = {}  # (pid,tid) -> {addr -> AggList}
+    per_pid_combined: Dict[int, Dict[int, AggList]] = collections.defaultdict(new_aggs)
+    # (pid, number of new keys) per merged thread, in arrival order: the per-PID dicts
+    # only grow at the end, so this replays the order (pid, addr) keys were first seen
+    new_keys: List[Tuple[int, int]] = []
     pids_seen = set()
-    for p in bin_paths:
-        try:
-            pid, tid, aggs = analyze_thread_file(p)
+    # Thread logs are independent, so parse them in worker processes; results
+    # are consumed in submission order to keep the output deterministic.
+    with ProcessPoolExecutor(max_workers=args.jobs or None) as ex:
+        futures = [(p, ex.submit(analyze_thread_file, p)) for p in bin_paths]
+        for p, fut in futures:
+            try:
+                pid, tid, aggs = fut.result()
+            except Exception as e:
+                print(f"Failed to parse {p}: {e}", file=sys.stderr)
+                continue
             per_thread[(pid, tid)] = aggs
             pids_seen.add(pid)
-        except Exception as e:
-            print(f"Failed to parse {p}: {e}", file=sys.stderr)
+            dst = per_pid_combined[pid]
+            n = len(dst)
+            merge_aggs(dst, aggs)
+            new_keys.append((pid, len(dst) - n))
 
     if not per_thread:
         print("No data aggregated.", file=sys.stderr)
         sys.exit(1)
 
-    # Build per-PID combined and global combined
-    per_pid_combined: Dict[int, Dict[int, Agg]] = collections.defaultdict(dict)
-    global_combined: Dict[Tuple[int,int], Agg] = {}  # (pid,addr)->Agg (keep pid to avoid addr collisions across PIDs)
-    for (pid, tid), aggs in per_thread.items():
-        # Merge into per-PID dict keyed by raw addr
-        merge_aggs(per_pid_combined[pid], aggs)
-        # Merge into global combined keyed by (pid,addr)
-        for addr, a in aggs.items():
-            global_combined[(pid, addr)] = agg_add(global_combined.get((pid, addr)),
-                                                   calls=a.calls, incl=a.incl_ns, excl=a.excl_ns, mx=a.max_incl_ns)
-
     # Load maps per PID if available
     pid_to_maps: Dict[int, List[Tuple[int,int,int,str,int]]] = {}
-    maps_files = {int(Path(m).stem.split(".")[0]): Path(m) for m in glob.glob(str(logdir / "*.maps")) if re.match(r"\d+\.maps$", Path(m).name)}
+    maps_files = {int(Path(m).stem.split(".")[0]): Path(m) for m in glob.glob(str(logdir / "*.maps")) if _MAPS_RE.match(Path(m).name)}
     for pid in pids_seen:
         mp = maps_files.get(pid)
         if mp and mp.exists():
@@ -337,18 +936,25 @@ def main():
             # If missing, we proceed without symbols for this PID.
             pass
 
-    # Build symbol caches:
-    #   1) address sets per PID (union across that PID's threads)
-    per_pid_addr_sets: Dict[int, set] = {pid: set() for pid in pids_seen}
-    for pid in pids_seen:
-        for addr in per_pid_combined[pid].keys():
-            per_pid_addr_sets[pid].add(addr)
-
-    addr2modvma, name_cache = build_symbol_cache(per_pid_addr_sets, pid_to_maps, args.no_symbols)
-
-    # Write per-thread CSVs
+    # Keyed by (pid,addr) to avoid addr collisions across PIDs; values are shared, not copied.
+    # Keys come in first-seen order across threads, so ties sort as with a per-thread merge.
+    pid_items = {pid: iter(aggs.items()) for pid, aggs in per_pid_combined.items()}
+    global_combined = {(pid, addr): a for pid, n in new_keys
+                       for addr, a in itertools.islice(pid_items[pid], n)}
+
+    # Build symbol caches: modules for every address (the address set of a PID is the key
+    # set of its combined dict), names only for addresses that will actually be shown
+    symbolize_sets = symbol_addr_sets(per_thread, per_pid_combined, global_combined,
+                                      args.sort, args.top, args.symbolize_min_ns)
+    cache_dir = None if args.no_symbol_cache else Path(args.symbol_cache)
+    addr2modvma, name_cache = build_symbol_cache(per_pid_combined, pid_to_maps, args.no_symbols,
+                                                 cache_dir, symbolize_sets)
+
+    # Write per-thread CSVs, releasing each thread's aggregates once written
     out_prefix = Path(args.out_prefix)
-    for (pid, tid), aggs in per_thread.items():
+    thread_keys = sorted(per_thread.keys())
+    while per_thread:
+        (pid, tid), aggs = per_thread.popitem()
         rows = rows_from_aggs(pid, aggs, addr2modvma, name_cache, args.sort, args.top)
         out_path = out_prefix.parent / f"{out_prefix.name}_pid_{pid}_tid_{tid}.csv"
         write_csv(out_path, rows)
@@ -360,32 +966,17 @@ def main():
         write_csv(out_path, rows)
 
     # Write global combined (across all PIDs/threads)
-    # We re-shape into a "fake PID" view by keeping PID as a column? For simplicity we
-    # keep same columns and resolve names with that PID's maps; if multiple PIDs exist,
-    # identical functions from different processes appear as separate rows.
-    global_rows = []
-    for (pid, addr), a in global_combined.items():
-        mod, vma = addr2modvma.get((pid, addr), ("", None))
-        name = name_cache.get((pid, mod, vma)) if (vma is not None) else None
-        func_disp = name if name else f"0x{addr:x}"
-        avg_incl = int(a.incl_ns / a.calls) if a.calls else 0
-        avg_excl = int(a.excl_ns / a.calls) if a.calls else 0
-        # To make the global file self-contained, prefix module with [pid]:
-        mod_disp = f"[pid {pid}] {mod}" if mod else f"[pid {pid}]"
-        global_rows.append([mod_disp, func_disp, a.calls, a.incl_ns, a.excl_ns, avg_incl, avg_excl, a.max_incl_ns])
-
-    key_idx = {"exclusive": 4, "inclusive": 3, "calls": 2}[args.sort]
-    global_rows.sort(key=lambda r: r[key_idx], reverse=True)
-    if args.top > 0:
-        global_rows = global_rows[:args.top]
-    write_csv(out_prefix.parent / f"{out_prefix.name}_combined.csv", global_rows)
+    # We keep the same columns and resolve names with each row's PID maps; if multiple
+    # PIDs exist, identical functions from different processes appear as separate rows.
+    rows = rows_from_aggs(None, global_combined, addr2modvma, name_cache, args.sort, args.top)
+    write_csv(out_prefix.parent / f"{out_prefix.name}_combined.csv", rows)
 
     # Summary
-    print(f"Threads analyzed: {len(per_thread)} across PIDs: {sorted(pids_seen)}")
+    print(f"Threads analyzed: {len(thread_keys)} across PIDs: {sorted(pids_seen)}")
     print(f"Wrote: {out_prefix.name}_combined.csv")
     for pid in sorted(pids_seen):
         print(f"Wrote: {out_prefix.name}_pid_{pid}_combined.csv")
-    for (pid, tid) in sorted(per_thread.keys()):
+    for (pid, tid) in thread_keys:
         print(f"Wrote: {out_prefix.name}_pid_{pid}_tid_{tid}.csv")
 
 